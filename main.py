@@ -1,6 +1,8 @@
 import logging
 from scraper import get_links, get_details
 
+logger = logging.getLogger(__name__)
+
 def main():
     logging.basicConfig(
         level=logging.INFO,
@@ -11,19 +13,14 @@ def main():
     base_url = "https://www.mubawab.ma/en/cc/real-estate-for-sale"
     max_pages = 1 
 
-    logging.info("Starting link scraping...")
-    links = get_links(base_url, max_pages=max_pages)
-    logging.info(f"Found {len(links)} property links.")
-
-    # 2. Scrape each property, upload raws to Supabase, and get cleaned DataFrame
-    logging.info("Scraping property details and uploading raw listings...")
-    df = get_details(links)
+    logger.info("Starting link scraping...")
+    links = get_links(base_url, max_pages=max_pages, listing_type="sale")
+    logger.info("Found %d property links.", len(links))
 
-    # 3. (Optional) save the cleaned data locally for now
-    # output_path = "mubawab_cleaned.pkl"
-    # df.to_pickle(output_path)
-    # logging.info(f"Saved cleaned data to {output_path}")
-    # logging.info("Done.")
+    # 2. Scrape each property and write raw + normalised rows to Supabase
+    logger.info("Scraping property details and uploading raw listings...")
+    count = get_details(links, listing_type="sale")
+    logger.info("Scraped %d properties.", count)
 
 
 if __name__ == "__main__":
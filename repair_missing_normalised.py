@@ -5,12 +5,11 @@
 
 import os
 import logging
-from dataclasses import asdict
 from datetime import datetime, timezone
 
 from supabase import create_client, Client
 from dotenv import load_dotenv
-from bs4 import BeautifulSoup
+from lxml import etree
 import re
 import json
 
@@ -32,6 +31,7 @@ logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s [%(levelname)s] %(message)s",
 )
+logger = logging.getLogger(__name__)
 
 # ----------------------------
 # IMPORT PARSERS FROM MAIN SCRAPER
@@ -40,7 +40,8 @@ logging.basicConfig(
 
 from scraper import (
     PropertyDetails,
-    parse_property_page,
+    parse_tree,
+    parse_property_page_from_tree,
     clean_integer,
     clean_text,
     clean_rooms,
@@ -48,76 +49,167 @@ from scraper import (
     clean_condition,
     parse_area_and_city,
     extract_coordinates,
-    get_image_links,
+    extract_image_urls_from_tree,
+    build_normalised_payload,
+    upsert_normalised_listings,
+    decompress_html,
+    SELECT_PAGE_SIZE,
+    IN_QUERY_CHUNK_SIZE,
 )
 
+REPAIR_CHUNK_SIZE = IN_QUERY_CHUNK_SIZE  # external_ids per raw_listings IN-query
+
 # ----------------------------
 # FIND MISSING NORMALISED LISTINGS
 # ----------------------------
 
-def get_missing_normalised_ids() -> list[str]:
+# The diff runs in Postgres via this function (create it once in Supabase):
+#
+#   create or replace function missing_normalised_ids(src text)
+#   returns table (external_id text)
+#   language sql stable as $$
+#       select r.external_id
+#       from raw_listings r
+#       left join normalised_listings n using (external_id)
+#       where r.source = src and n.external_id is null
+#       order by r.external_id
+#   $$;
+
+def get_missing_normalised_ids(source: str = "mubawab") -> list[str]:
     """Return a list of external_ids that exist in raw_listings but not in normalised_listings."""
-    logging.info("Checking for missing normalised listings...")
+    logger.info("Checking for missing normalised listings...")
+
+    try:
+        missing = []
+        # PostgREST caps set-returning RPCs at max-rows too, so page through
+        offset = 0
+        while True:
+            rows = (
+                supabase.rpc("missing_normalised_ids", {"src": source})
+                .order("external_id")
+                .range(offset, offset + SELECT_PAGE_SIZE - 1)
+                .execute()
+                .data
+            ) or []
+            missing.extend(row["external_id"] for row in rows)
+            if len(rows) < SELECT_PAGE_SIZE:
+                break
+            offset += SELECT_PAGE_SIZE
+    except Exception as e:
+        logger.warning(
+            "missing_normalised_ids RPC unavailable (%s); diffing ids client-side.", e
+        )
+        missing = _get_missing_normalised_ids_client_side()
+
+    logger.info("Found %d missing normalised listings.", len(missing))
+    return missing
 
+def _get_missing_normalised_ids_client_side() -> list[str]:
+    """Fallback: pull both id columns and diff them in Python."""
     raw_res = supabase.table("raw_listings").select("external_id").execute()
     norm_res = supabase.table("normalised_listings").select("external_id").execute()
 
     raw_ids = {row["external_id"] for row in raw_res.data}
     norm_ids = {row["external_id"] for row in norm_res.data}
 
-    missing = sorted(list(raw_ids - norm_ids))
-    logging.info("Found %d missing normalised listings.", len(missing))
-    return missing
+    return sorted(raw_ids - norm_ids)
 
 # ----------------------------
-# REPAIR A SINGLE LISTING
+# REPAIR A CHUNK OF LISTINGS
 # ----------------------------
 
-def repair_single_listing(external_id: str):
-    logging.info("Repairing %s ...", external_id)
-
-    # 1) Retrieve stored HTML + metadata
-    res = supabase.table("raw_listings").select("*").eq("external_id", external_id).limit(1).execute()
-    if not res.data:
-        logging.error("Missing raw_listing row for %s", external_id)
-        return False
-
-    payload = res.data[0]["payload_json"]
-    html = payload.get("html")
-    url = payload.get("url")
+def chunks(items: list, size: int):
+    """Yield successive slices of `items` of length `size`."""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def fetch_raw_rows(external_ids: list[str]) -> list[dict]:
+    """
+    Retrieve stored HTML + metadata for many listings in one query, shipping
+    only the payload_json fields the repair reads.
+    """
+    res = (
+        supabase.table("raw_listings")
+        .select(
+            "external_id,"
+            "url:payload_json->>url,"
+            "html:payload_json->>html,"
+            "html_gz_b64:payload_json->>html_gz_b64,"
+            "image_urls:payload_json->image_urls,"
+            "listing_tier:payload_json->>listing_tier,"
+            "listing_type:payload_json->>listing_type,"
+            "is_adboost:payload_json->is_adboost"
+        )
+        .in_("external_id", external_ids)
+        .execute()
+    )
+    rows = res.data or []
+
+    found = {row["external_id"] for row in rows}
+    for external_id in external_ids:
+        if external_id not in found:
+            logger.error("Missing raw_listing row for %s", external_id)
+
+    return rows
+
+def repair_rows(rows: list[dict]) -> int:
+    """
+    Parse the stored HTML of each raw_listings row, upsert all resulting
+    normalised rows in one request, then repair their images.
+    Returns the number of listings repaired.
+    """
+    update_payloads: list[dict] = []
+    image_jobs: list[tuple[str, list[str]]] = []
+
+    for row in rows:
+        external_id = row["external_id"]
+        html = row.get("html")
+        if not html and row.get("html_gz_b64"):
+            html = decompress_html(row["html_gz_b64"])
+        url = row.get("url")
+
+        if not html:
+            logger.error("No HTML stored for %s", external_id)
+            continue
 
-    if not html:
-        logging.error("No HTML stored for %s", external_id)
-        return False
+        # 1) Parse the HTML once into structured fields (and image URLs,
+        #    for older rows stored without them)
+        try:
+            tree = parse_tree(html)
+        except etree.ParserError:
+            tree = None
+        details = parse_property_page_from_tree(url, tree) if tree is not None else None
+        if details is None:
+            logger.error("Failed to parse stored HTML for %s", external_id)
+            continue
 
-    # 2) Parse the HTML into structured fields
-    details = parse_property_page(url, html)
-    if details is None:
-        logging.error("Failed to parse stored HTML for %s", external_id)
-        return False
+        update_payloads.append(
+            build_normalised_payload(
+                details,
+                external_id,
+                source="mubawab",
+                # Rows stored before listing_type was recorded are all rent
+                listing_type=row.get("listing_type") or "rent",
+                listing_tier=row.get("listing_tier"),
+                is_adboost=row.get("is_adboost"),
+                main_image_path=None,  # will fix later
+            )
+        )
+        image_urls = row.get("image_urls") or extract_image_urls_from_tree(tree)
+        image_jobs.append((external_id, image_urls))
 
-    # 3) Insert/Upsert into normalised_listings (WITHOUT images)
-    update_payload = asdict(details)
-    update_payload.update(
-        {
-            "external_id": external_id,
-            "source": "mubawab",
-            "listing_type": "rent",
-            "main_image_path": None,  # will fix later
-        }
-    )
+    if not update_payloads:
+        return 0
 
-    supabase.table("normalised_listings").upsert(
-        update_payload,
-        on_conflict="external_id",
-    ).execute()
+    # 2) Insert/Upsert into normalised_listings (WITHOUT images)
+    upsert_normalised_listings(update_payloads)
 
-    # 4) Repair image table if missing
-    image_urls = payload.get("image_urls", [])
-    repair_listing_images(external_id, image_urls)
+    # 3) Repair image table if missing
+    for external_id, image_urls in image_jobs:
+        repair_listing_images(external_id, image_urls)
+        logger.debug("Repaired %s successfully.", external_id)
 
-    logging.info("Repaired %s successfully.", external_id)
-    return True
+    return len(update_payloads)
 
 # ----------------------------
 # REPAIR LISTING IMAGES (NO R2 UPLOAD)
@@ -126,38 +218,38 @@ def repair_single_listing(external_id: str):
 
 def repair_listing_images(external_id: str, image_urls: list[str]):
     if not image_urls:
-        logging.info("%s has no stored images in raw_listings.", external_id)
+        logger.debug("%s has no stored images in raw_listings.", external_id)
         return
 
-    main_image_path = None
-
-    for idx, url in enumerate(image_urls):
-        # Check if exists
-        exists = (
+    # One query for every image row this listing already has
+    existing = {
+        row["image_index"]: row["storage_path"]
+        for row in (
             supabase.table("listing_images")
-            .select("storage_path")
+            .select("image_index,storage_path")
             .eq("external_id", external_id)
-            .eq("image_index", idx)
             .execute()
             .data
         )
-        if exists:
-            if idx == 0:
-                main_image_path = exists[0]["storage_path"]
-            continue
+    }
 
-        # Insert placeholder entry using the original URL only
-        # storage_path remains NULL (since no R2 upload here)
-        supabase.table("listing_images").insert(
-            {
-                "external_id": external_id,
-                "image_index": idx,
-                "original_url": url,
-                "storage_path": None,
-            }
-        ).execute()
+    # Insert placeholder entries using the original URL only
+    # storage_path remains NULL (since no R2 upload here)
+    to_insert = [
+        {
+            "external_id": external_id,
+            "image_index": idx,
+            "original_url": url,
+            "storage_path": None,
+        }
+        for idx, url in enumerate(image_urls)
+        if idx not in existing
+    ]
+    if to_insert:
+        supabase.table("listing_images").insert(to_insert).execute()
 
     # Patch main image if missing
+    main_image_path = existing.get(0)
     if main_image_path:
         supabase.table("normalised_listings").update(
             {"main_image_path": main_image_path}
@@ -170,16 +262,16 @@ def repair_listing_images(external_id: str, image_urls: list[str]):
 def main():
     missing_ids = get_missing_normalised_ids()
     if not missing_ids:
-        logging.info("Nothing to repair — all normalised listings are present.")
+        logger.info("Nothing to repair — all normalised listings are present.")
         return
 
     repaired = 0
 
-    for ext_id in missing_ids:
-        if repair_single_listing(ext_id):
-            repaired += 1
+    for chunk in chunks(missing_ids, REPAIR_CHUNK_SIZE):
+        logger.info("Repairing %d listings starting at %s ...", len(chunk), chunk[0])
+        repaired += repair_rows(fetch_raw_rows(chunk))
 
-    logging.info("Repair completed: %d/%d listings fixed.", repaired, len(missing_ids))
+    logger.info("Repair completed: %d/%d listings fixed.", repaired, len(missing_ids))
 
 
 if __name__ == "__main__":
@@ -2,8 +2,10 @@
 
 import logging
 import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from dataclasses import asdict
-from typing import List, Dict, Any, Optional
+from itertools import chain
+from typing import List, Dict, Any, Iterator, Optional
 
 from dotenv import load_dotenv
 from supabase import create_client, Client
@@ -13,7 +15,10 @@ import tqdm
 from scraper import (
     PropertyDetails,
     parse_property_page,
-    upsert_normalised_listing,
+    decompress_html,
+    build_normalised_payload,
+    upsert_normalised_listings,
+    UPSERT_BATCH_SIZE,
 )
 
 # ---------- Supabase setup ----------
@@ -32,160 +37,260 @@ logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s [%(levelname)s] %(message)s",
 )
+logger = logging.getLogger(__name__)
 
 SOURCE = "mubawab"
-LISTING_TYPE = "rent"   # adjust if you later distinguish buy/rent in raw_listings
+LISTING_TYPE = "rent"   # rebuild only this listing type (payload_json.listing_type)
 BATCH_SIZE = 200       # for paginating raw_listings
+PARSE_WORKERS = None   # parser processes; None → one per CPU core
+PARSE_CHUNKSIZE = 16   # rows sent to a parser process at a time
 
 # ---------- Helpers ----------
 
-def fetch_all_raw_listings(source: str = SOURCE) -> list[dict]:
-    """
-    Fetch ALL rows from raw_listings for a given source using paginated
-    `.range()` queries (Supabase/PostgREST safe pagination).
-    """
-    all_rows: list[dict] = []
-    start = 0
+# Only ship the payload_json fields the rebuild reads, not the whole document
+RAW_COLUMNS = (
+    "external_id, "
+    "url:payload_json->>url, "
+    "html:payload_json->>html, "
+    "html_gz_b64:payload_json->>html_gz_b64, "
+    "listing_tier:payload_json->>listing_tier, "
+    "listing_type:payload_json->>listing_type, "
+    "is_adboost:payload_json->is_adboost"
+)
 
-    while True:
-        end = start + BATCH_SIZE - 1
 
-        try:
-            resp = (
-                supabase.table("raw_listings")
-                .select("external_id, payload_json")
-                .eq("source", source)
-                .order("external_id")
-                .range(start, end)       # <-- POSTGREST-COMPLIANT PAGINATION
-                .execute()
-            )
-        except Exception as e:
-            logging.error(
-                f"Failed to fetch batch start={start}, end={end}: {e}"
-            )
-            # If first batch fails, abort
-            if start == 0:
-                raise
-            break
+def _fetch_raw_batch(
+    source: str,
+    since_external_id: Optional[str],
+    listing_type: str = LISTING_TYPE,
+) -> list[dict]:
+    """
+    Fetch the next BATCH_SIZE raw_listings rows of listing_type after
+    since_external_id (keyset pagination, so later pages cost the same as
+    the first).
+    """
+    query = (
+        supabase.table("raw_listings")
+        .select(RAW_COLUMNS)
+        .eq("source", source)
+    )
+    if listing_type == "rent":
+        # Rows stored before listing_type was recorded are all rent
+        query = query.or_(
+            "payload_json->>listing_type.is.null,payload_json->>listing_type.eq.rent"
+        )
+    else:
+        query = query.eq("payload_json->>listing_type", listing_type)
+    if since_external_id is not None:
+        query = query.gt("external_id", since_external_id)
+    resp = query.order("external_id").limit(BATCH_SIZE).execute()
+    batch = resp.data or []
+    logger.info("Fetched batch after %s: %d rows", since_external_id, len(batch))
+    return batch
+
+
+def iter_raw_listings(
+    source: str = SOURCE,
+    since_external_id: Optional[str] = None,
+    listing_type: str = LISTING_TYPE,
+) -> Iterator[list[dict]]:
+    """
+    Yield raw_listings rows for a given source and listing type one batch
+    at a time, so only one batch of HTML payloads is held in memory. The
+    next batch is fetched
+    on a background thread while the caller parses the current one.
 
-        batch = resp.data or []
+    Pass since_external_id to resume after a given row.
+    """
+    cursor = since_external_id
+    total = 0
 
-        logging.info(
-            f"Fetched batch {start}-{end}: {len(batch)} rows"
-        )
+    with ThreadPoolExecutor(max_workers=1) as prefetch:
+        future = prefetch.submit(_fetch_raw_batch, source, cursor, listing_type)
 
-        all_rows.extend(batch)
+        while future is not None:
+            try:
+                batch = future.result()
+            except Exception as e:
+                logger.error("Failed to fetch batch after %s: %s", cursor, e)
+                # If first batch fails, abort
+                if total == 0:
+                    raise
+                break
 
-        # If batch smaller than BATCH_SIZE → last page reached
-        if len(batch) < BATCH_SIZE:
-            break
+            # If batch smaller than BATCH_SIZE → last page reached
+            if len(batch) < BATCH_SIZE:
+                future = None
+            else:
+                cursor = batch[-1]["external_id"]
+                future = prefetch.submit(_fetch_raw_batch, source, cursor, listing_type)
 
-        start += BATCH_SIZE
+            total += len(batch)
+            yield batch
 
-    logging.info(
-        f"TOTAL raw_listings loaded for source '{source}': {len(all_rows)}"
-    )
-    return all_rows
+    logger.info("TOTAL raw_listings loaded for source '%s': %d", source, total)
 
 
-def wipe_normalised_listings(source: str = SOURCE) -> None:
+def wipe_normalised_listings(source: str = SOURCE, listing_type: str = LISTING_TYPE) -> None:
     """
-    Delete all rows in normalised_listings for the given source.
-    This ensures we fully rebuild from raw_listings.
+    Delete all rows in normalised_listings for the given source and listing type.
+    This ensures we fully rebuild them from raw_listings.
     """
-    logging.info("Deleting existing normalised_listings rows for source='%s'...", source)
+    logger.info(
+        "Deleting existing normalised_listings rows for source='%s', listing_type='%s'...",
+        source,
+        listing_type,
+    )
     (
         supabase.table("normalised_listings")
         .delete()
         .eq("source", source)
+        .eq("listing_type", listing_type)
         .execute()
     )
-    logging.info("Delete completed.")
+    logger.info("Delete completed.")
 
 
 # ---------- Core repair logic ----------
 
+def _parse_worker(
+    args: tuple[str, Optional[str], Optional[str]],
+) -> tuple[Optional[PropertyDetails], Optional[str]]:
+    """
+    Parse one (url, html, html_gz_b64) row in a worker process; html is
+    set on rows stored before pages were gzipped, html_gz_b64 after.
+    Returns (details, error); error is set if parsing raised.
+    """
+    url, html, html_gz_b64 = args
+    try:
+        if not html:
+            html = decompress_html(html_gz_b64)
+        return parse_property_page(url, html), None
+    except Exception as exc:
+        return None, str(exc)
+
+
 def rebuild_normalised_from_raw() -> None:
     """
     Main repair routine:
-      1. Load all raw_listings for SOURCE.
-      2. Wipe normalised_listings for SOURCE.
-      3. For each raw row:
-            - read url + html from payload_json
+      1. Fetch the first raw_listings batch for SOURCE / LISTING_TYPE.
+      2. Wipe normalised_listings for SOURCE / LISTING_TYPE.
+      3. Stream the remaining raw_listings batch by batch. For each raw row:
+            - read url + html (projected out of payload_json, gunzipped if stored gzipped)
             - parse into PropertyDetails
-            - upsert into normalised_listings
+            - upsert into normalised_listings, UPSERT_BATCH_SIZE rows per request
     """
-    raw_rows = fetch_all_raw_listings(source=SOURCE)
+    batches = iter_raw_listings(source=SOURCE, listing_type=LISTING_TYPE)
+    # Pull the first batch before wiping, so a failed fetch leaves
+    # normalised_listings untouched
+    first_batch = next(batches, [])
 
     # Wipe old normalised rows so we rebuild everything from raw_listings
-    wipe_normalised_listings(source=SOURCE)
+    wipe_normalised_listings(source=SOURCE, listing_type=LISTING_TYPE)
 
+    processed_count = 0
     success_count = 0
     fail_count = 0
     parse_none_count = 0
+    pending: list[dict] = []
 
-    for row in tqdm.tqdm(raw_rows, desc="Rebuilding normalised_listings from raw_listings"):
-        external_id = row.get("external_id")
-        payload = row.get("payload_json") or {}
-
-        url = payload.get("url")
-        html = payload.get("html")
-
-        if not external_id:
-            logging.warning("Row without external_id, skipping: %s", row)
-            fail_count += 1
-            continue
-
-        if not html or not url:
-            logging.warning("Missing html/url in payload_json for external_id=%s, skipping.", external_id)
-            fail_count += 1
-            continue
-
+    def flush() -> None:
+        nonlocal success_count, fail_count
+        if not pending:
+            return
         try:
-            details = parse_property_page(url, html)
+            upsert_normalised_listings(pending)
+            success_count += len(pending)
         except Exception as exc:
-            logging.error(
-                "Exception while parsing external_id=%s url=%s: %s",
-                external_id,
-                url,
+            logger.error(
+                "Failed to upsert batch of %d normalised_listings (first external_id=%s): %s",
+                len(pending),
+                pending[0]["external_id"],
                 exc,
             )
-            fail_count += 1
-            continue
-
-        if details is None:
-            # parse_property_page decided this page is invalid/missing critical tags
-            logging.warning(
-                "parse_property_page returned None for external_id=%s url=%s",
-                external_id,
-                url,
-            )
-            parse_none_count += 1
-            continue
-
-        try:
-            upsert_normalised_listing(
-                details=details,
-                external_id=external_id,
-                source=SOURCE,
-                listing_type=LISTING_TYPE,
-                main_image_path=None,  # images are handled separately
-            )
-            success_count += 1
-        except Exception as exc:
-            logging.error(
-                "Failed to upsert normalised_listing for external_id=%s url=%s: %s",
-                external_id,
-                url,
-                exc,
+            fail_count += len(pending)
+        pending.clear()
+
+    progress = tqdm.tqdm(desc="Rebuilding normalised_listings from raw_listings", unit="rows")
+
+    # Parsing is CPU-bound, so fan each batch out across processes; the main
+    # process keeps the bookkeeping and the batched upserts.
+    with ProcessPoolExecutor(max_workers=PARSE_WORKERS) as pool:
+        for batch in chain([first_batch], batches):
+            to_parse: list[dict] = []
+
+            for row in batch:
+                processed_count += 1
+                external_id = row.get("external_id")
+                url = row.get("url")
+                html = row.get("html") or row.get("html_gz_b64")
+
+                if not external_id:
+                    logger.warning("Row without external_id, skipping: %s", row)
+                    fail_count += 1
+                    continue
+
+                if not html or not url:
+                    logger.warning("Missing html/url in payload_json for external_id=%s, skipping.", external_id)
+                    fail_count += 1
+                    continue
+
+                to_parse.append(row)
+
+            results = pool.map(
+                _parse_worker,
+                [(row["url"], row.get("html"), row.get("html_gz_b64")) for row in to_parse],
+                chunksize=PARSE_CHUNKSIZE,
             )
-            fail_count += 1
 
-    logging.info("=== Repair complete ===")
-    logging.info("Total raw_listings processed: %d", len(raw_rows))
-    logging.info("Successfully normalised:      %d", success_count)
-    logging.info("parse_property_page == None: %d", parse_none_count)
-    logging.info("Failed (exceptions/invalid): %d", fail_count)
+            for row, (details, error) in zip(to_parse, results):
+                external_id = row["external_id"]
+                url = row["url"]
+
+                if error is not None:
+                    logger.error(
+                        "Exception while parsing external_id=%s url=%s: %s",
+                        external_id,
+                        url,
+                        error,
+                    )
+                    fail_count += 1
+                    continue
+
+                if details is None:
+                    # parse_property_page decided this page is invalid/missing critical tags
+                    logger.warning(
+                        "parse_property_page returned None for external_id=%s url=%s",
+                        external_id,
+                        url,
+                    )
+                    parse_none_count += 1
+                    continue
+
+                pending.append(
+                    build_normalised_payload(
+                        details=details,
+                        external_id=external_id,
+                        source=SOURCE,
+                        listing_type=row.get("listing_type") or LISTING_TYPE,
+                        listing_tier=row.get("listing_tier"),
+                        is_adboost=row.get("is_adboost"),
+                        main_image_path=None,  # images are handled separately
+                    )
+                )
+                if len(pending) >= UPSERT_BATCH_SIZE:
+                    flush()
+
+            progress.update(len(batch))
+
+    progress.close()
+    flush()
+
+    logger.info("=== Repair complete ===")
+    logger.info("Total raw_listings processed: %d", processed_count)
+    logger.info("Successfully normalised:      %d", success_count)
+    logger.info("parse_property_page == None: %d", parse_none_count)
+    logger.info("Failed (exceptions/invalid): %d", fail_count)
 
 
 # ---------- Entry point ----------
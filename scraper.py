@@ -1,21 +1,26 @@
 #--------------Imports--------------#
 
+import asyncio
+import base64
+import gzip
 import logging
+import operator
 import os
-from dataclasses import dataclass, asdict
+import threading
+import zlib
+from dataclasses import dataclass, fields
 from datetime import datetime, timezone
-from time import sleep
+from functools import lru_cache
+from time import sleep, time
 from random import uniform
-from typing import List, Optional, Tuple
+from typing import Iterator, List, Optional, Tuple, Union
 
-import pandas as pd
-import requests
+import httpx
 import tqdm
 import boto3
 from botocore.client import Config
-from requests.adapters import HTTPAdapter, Retry
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from bs4 import BeautifulSoup
+from lxml import etree
 from dotenv import load_dotenv
 from supabase import create_client, Client
 from urllib.parse import unquote
@@ -50,7 +55,14 @@ r2_client = boto3.client(
     endpoint_url=CF_BASE_URL,
     aws_access_key_id=CF_ACCESS_KEY_ID,
     aws_secret_access_key=CF_SECRET_ACCESS_KEY,
-    config=Config(signature_version="s3v4"),
+    config=Config(
+        signature_version="s3v4",
+        # Room for every parallel image upload (IMAGE_WORKERS) to keep its
+        # connection open between listings instead of reconnecting
+        max_pool_connections=16,
+        tcp_keepalive=True,
+        retries={"max_attempts": 5, "mode": "adaptive"},
+    ),
 )
 
 #--------------Constants and Session Setup--------------#
@@ -64,26 +76,106 @@ USER_AGENT = (
 REQUEST_TIMEOUT = 15  # seconds
 MIN_SLEEP = 1  # seconds
 MAX_SLEEP = 3  # seconds
+UPSERT_BATCH_SIZE = 500  # rows per Supabase upsert request
+SELECT_PAGE_SIZE = 1000  # PostgREST's default max rows per response
+IN_QUERY_CHUNK_SIZE = 200  # ids per .in_() GET, well inside URL length limits
+CONCURRENCY = 8  # listing pages in flight at once
+PARSE_WORKERS = 4  # threads parsing pages while downloads continue
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 0.5  # seconds; doubled on every retry
+MAX_RETRY_AFTER = 60  # seconds; cap on a server-sent Retry-After
+MAX_KEEPALIVE_CONNECTIONS = 32
+HTML_GZIP_LEVEL = 6  # stored page HTML compresses ~6-10x at this level
+# "" disables the cache. Expired entries are deleted when their listing is
+# read again; pages of listings never revisited stay until the directory is
+# removed by hand.
+HTML_CACHE_DIR = os.getenv("SCRAPE_CACHE_DIR", ".scrape_cache")
+HTML_CACHE_TTL = 7 * 24 * 3600  # seconds a cached listing page stays fresh
+IMAGE_WORKERS = 8  # image downloads/uploads in flight per listing
+INDEX_FEED_SIZE = 16 * 1024  # bytes of index page fed to the parser at a time
+LISTING_PAGE_MARKER = b"orangeTit"  # price heading class every listing page has
+
+# Patterns used on every listing, compiled once
+_RE_NON_DIGIT = re.compile(r"[^\d]")
+_RE_DIGITS = re.compile(r"\d+")
+_RE_ROOMS = re.compile(r"(\d+)\s*(?:\w+\s)?rooms?\b", re.IGNORECASE)
+_RE_AREA_IN = re.compile(r"^(.*)\s+in\s+(.*)$", re.IGNORECASE)
+_RE_EXT_ID = re.compile(r"/(a|pa)/(\d+)")
+_RE_WAZE = re.compile(r"waze\.com/ul\?ll=([^&]+)")
+
+# HTTP/2 lets concurrent requests to mubawab.ma share one TCP/TLS connection.
+# The transport retries failed connects; fetch() retries RETRY_STATUSES.
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS)
+
+session = httpx.Client(
+    http2=True,
+    headers={"User-Agent": USER_AGENT},
+    timeout=REQUEST_TIMEOUT,
+    follow_redirects=True,
+    transport=httpx.HTTPTransport(http2=True, retries=MAX_RETRIES, limits=HTTP_LIMITS),
+)
 
-session = requests.Session()
-session.headers.update({"User-Agent": USER_AGENT})
-retries = Retry(
-    total=3,
-    backoff_factor=0.5,
-    status_forcelist=[429, 500, 502, 503, 504],
-    allowed_methods=["HEAD", "GET", "OPTIONS"],
+# Property pages are parsed straight into lxml and queried with precompiled
+# XPath, which skips the BeautifulSoup wrapper objects entirely. One tree
+# serves both the PropertyDetails fields and the image URLs. It is a plain
+# etree parser: lxml.html's would run a Python-level class lookup for every
+# element the XPaths hand back. lxml locks a parser while it runs, so each
+# PARSE_WORKERS thread gets its own instead of sharing one module-wide.
+_detail_parsers = threading.local()
+
+
+def _detail_parser() -> etree.HTMLParser:
+    """The calling thread's detail-page parser, created on first use."""
+    parser = getattr(_detail_parsers, "parser", None)
+    if parser is None:
+        parser = _detail_parsers.parser = etree.HTMLParser(encoding="utf-8")
+    return parser
+
+
+def _cls(name: str) -> str:
+    """XPath predicate matching one token of a space-separated class attribute."""
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+_XP_PRICE = etree.XPath(f"(//h3[{_cls('orangeTit')}])[1]")
+_XP_AREA = etree.XPath(f"(//h3[{_cls('greyTit')}])[1]")
+_XP_TITLE = etree.XPath(f"(//h1[{_cls('searchTitle')}])[1]")
+_XP_DESCRIPTION = etree.XPath(f"(//div[{_cls('wordBreak')}])[1]")
+# Raw string-length is an upper bound on the stripped length the fallback
+# checks, so libxml2 drops the short <p> tags before Python sees them
+_XP_LONG_PARAGRAPHS = etree.XPath("//p[string-length(.) > 50]")
+_XP_MAIN_FEATURES = etree.XPath(
+    f"(//div[{_cls('adFeatures')}])[1]//div[{_cls('adMainFeatureContent')}]"
+)
+_XP_DETAIL_FEATURES = etree.XPath(f"//div[{_cls('adDetailFeature')}]")
+_XP_FEATURE_PILLS = etree.XPath(f"//p[{_cls('fSize11')} and {_cls('centered')}]")
+_XP_WAZE_TEXTS = etree.XPath("//script[contains(., 'waze.com/ul')]/text()")
+_XP_BUSINESS_NAME = etree.XPath(
+    f"((//div[{_cls('businessInfo')}])[1]"
+    f"//span[{_cls('link')} and {_cls('businessName')}])[1]"
+)
+_XP_LINK = etree.XPath("(.//a[@href])[1]")
+_XP_IMAGE_SRCS = etree.XPath("(//div[@id='masonryPhoto'])[1]//img/@src")
+
+# adDetailFeature label token -> PropertyDetails field, matched against the
+# lowercased feature text ("piece" also matches "Pieces", "room" matches
+# "Rooms"; bathroom is checked before room, which it contains)
+DETAIL_CATEGORIES = (
+    ("m²", "size"),
+    ("piece", "rooms"),
+    ("bathroom", "bathrooms"),
+    ("room", "bedrooms"),
 )
-adapter = HTTPAdapter(max_retries=retries)
-session.mount("http://", adapter)
-session.mount("https://", adapter)
 
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s [%(levelname)s] %(message)s",
 )
+logger = logging.getLogger(__name__)
 
 #--------------Data Classes--------------#
-@dataclass
+@dataclass(slots=True)
 class PropertyDetails:
     title: Optional[str]
     description: Optional[str]
@@ -109,18 +201,57 @@ class PropertyDetails:
     agent_name: Optional[str] = None
     agent_url: Optional[str] = None
 
+# Pull the PropertyDetails fields in one C-level call instead of asdict()'s
+# recursive copy. normalised_listings columns come straight from them.
+_PD_FIELDS = tuple(f.name for f in fields(PropertyDetails))
+_NORMALISED_FIELDS = tuple(name for name in _PD_FIELDS if name != "agent_url")
+_NORMALISED_GET = operator.attrgetter(*_NORMALISED_FIELDS)
+
+@dataclass(slots=True)
+class ScrapedListing:
+    """A fetched + parsed listing that hasn't been written to Supabase yet."""
+    external_id: str
+    listing_tier: str
+    is_adboost: bool
+    details: PropertyDetails
+    image_urls: list[str]
+    raw_row: dict
+
 #--------------Helper Functions--------------#
 
-def load_existing_external_ids(
+# Text under <script>/<style> is code, not page text; bs4's get_text
+# skipped it and itertext() does not
+_XP_VISIBLE_TEXT = etree.XPath(".//text()[not(ancestor::script or ancestor::style)]")
+
+def node_text(node: etree._Element, separator: str = "", strip: bool = False) -> str:
+    """
+    lxml equivalent of BeautifulSoup's get_text(separator, strip=...),
+    including its skipping of <script> and <style> contents.
+    """
+    texts = _XP_VISIBLE_TEXT(node)
+    if strip:
+        texts = [t for t in (t.strip() for t in texts) if t]
+    return separator.join(texts)
+
+def find_known_external_ids(
+    external_ids: list[str],
     source: str = "mubawab",
     listing_type: Optional[str] = "rent",
 ) -> set[str]:
+    """
+    Return the subset of external_ids already in normalised_listings.
+    One indexed IN-query per index page, so the cost follows the page
+    rather than the size of the table.
+    """
     ids: set[str] = set()
+    if not external_ids:
+        return ids
     try:
         query = (
             supabase.table("normalised_listings")
             .select("external_id")
             .eq("source", source)
+            .in_("external_id", external_ids)
         )
         if listing_type is not None:
             query = query.eq("listing_type", listing_type)
@@ -129,9 +260,8 @@ def load_existing_external_ids(
             eid = row.get("external_id")
             if eid:
                 ids.add(eid)
-        logging.info("Loaded %d existing external_ids into cache.", len(ids))
     except Exception as e:
-        logging.error("Failed to load existing ids: %s", e)
+        logger.error("Failed to look up existing ids: %s", e)
     return ids
 
 def is_already_scraped(external_id: str, existing_ids: set[str]) -> bool:
@@ -141,70 +271,202 @@ def is_already_scraped(external_id: str, existing_ids: set[str]) -> bool:
     """
     return external_id in existing_ids
 
-def process_single_listing(
+def _html_cache_path(external_id: str) -> str:
+    return os.path.join(HTML_CACHE_DIR, f"{external_id}.html.gz")
+
+def read_cached_html(external_id: str) -> Optional[bytes]:
+    """
+    Return the cached page bytes for a listing, or None if caching is off,
+    there is no entry, or it is older than HTML_CACHE_TTL. Expired and
+    unreadable entries are deleted, so the cache only holds fresh pages
+    and a corrupt file doesn't shadow the listing on later runs.
+    """
+    if not HTML_CACHE_DIR:
+        return None
+    path = _html_cache_path(external_id)
+    try:
+        if time() - os.path.getmtime(path) > HTML_CACHE_TTL:
+            os.remove(path)
+            return None
+        with open(path, "rb") as f:
+            return gzip.decompress(f.read())
+    except FileNotFoundError:
+        return None
+    except (OSError, EOFError, gzip.BadGzipFile, zlib.error) as e:
+        logger.warning("Dropping unreadable cached HTML for %s: %s", external_id, e)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return None
+
+def write_cached_html(external_id: str, content: bytes) -> None:
+    """Store a fetched listing page gzipped under HTML_CACHE_DIR."""
+    if not HTML_CACHE_DIR:
+        return
+    path = _html_cache_path(external_id)
+    tmp_path = f"{path}.tmp"
+    try:
+        os.makedirs(HTML_CACHE_DIR, exist_ok=True)
+        with open(tmp_path, "wb") as f:
+            f.write(gzip.compress(content, compresslevel=HTML_GZIP_LEVEL))
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning("Could not cache HTML for %s: %s", external_id, e)
+
+def is_listing_page(resp: httpx.Response) -> bool:
+    """
+    Cheap check that resp is a listing page before it is cached or parsed.
+    Captcha/interstitial pages come back as 200 too; without the price
+    heading parse_property_page_from_tree would reject them anyway.
+    """
+    content_type = resp.headers.get("Content-Type", "html")
+    if "html" not in content_type or LISTING_PAGE_MARKER not in resp.content:
+        logger.warning("Not a listing page (%s): %s", content_type, resp.url)
+        return False
+    return True
+
+def build_scraped_listing(
     listing_meta: dict,
+    html: Union[str, bytes],
     source: str = "mubawab",
     listing_type: str = "rent",
-) -> Optional[dict]:
+) -> Optional[ScrapedListing]:
+    """
+    Parse a fetched listing page into a ScrapedListing (no I/O).
+    Pass the response bytes as html: lxml parses them and raw_listings
+    gzips them as-is, so the page is never decoded to a str here.
+    """
     url = listing_meta["url"]
     external_id = listing_meta["external_id"]
     listing_tier = listing_meta["listing_tier"]
+    is_adboost = listing_meta.get("is_adboost", False)
 
-    resp = fetch(url)
-    if resp is None:
+    try:
+        tree = parse_tree(html)
+    except etree.ParserError as exc:
+        logger.warning("Could not parse HTML for %s: %s", url, exc)
         return None
 
-    soup = BeautifulSoup(resp.text, "html.parser")
-    image_urls = get_image_links(soup)
+    image_urls = extract_image_urls_from_tree(tree)
 
-    agent_type, agent_name, agent_url = extract_agency_info(soup)
-
-    # Parse property details
-    details = parse_property_page(url, resp.text)
+    # Parse property details (agent metadata included)
+    details = parse_property_page_from_tree(url, tree)
     if details is None:
         return None
 
-    # Attach agency info to details dataclass
-    details.agent_type = agent_type
-    details.agent_name = agent_name
-    details.agent_url = agent_url
-
-    # 1) Save raw listing (including agency + tier)
-    save_raw_listing(
+    raw_row = build_raw_listing_row(
         source=source,
-        listing_type=listing_type,
         external_id=external_id,
         link=url,
-        response_text=resp.text,
+        response_text=html,
         image_urls=image_urls,
         listing_tier=listing_tier,
-        agent_type=agent_type,
-        agent_name=agent_name,
-        agent_url=agent_url,
+        is_adboost=is_adboost,
+        details=details,
+        listing_type=listing_type,
     )
 
-    # 2) Upload images to R2 and create listing_images rows
-    main_image_path = process_listing_images(external_id, image_urls)
-
-    # 3) Upsert into normalised_listings
-    upsert_normalised_listing(
-        details=details,
+    return ScrapedListing(
         external_id=external_id,
-        source=source,
-        listing_type=listing_type,
-        main_image_path=main_image_path,
         listing_tier=listing_tier,
+        is_adboost=is_adboost,
+        details=details,
+        image_urls=image_urls,
+        raw_row=raw_row,
     )
 
-    return asdict(details)
+async def process_single_listing_async(
+    http: httpx.AsyncClient,
+    sem: asyncio.Semaphore,
+    parse_pool: ThreadPoolExecutor,
+    listing_meta: dict,
+    source: str = "mubawab",
+    listing_type: str = "rent",
+) -> Optional[ScrapedListing]:
+    """
+    Fetch (or read from the local HTML cache) and parse one listing.
+    Nothing is written to Supabase here: the result is handed to
+    persist_listings() so those writes can be batched. The jittered sleep
+    is held inside the semaphore, so each of the CONCURRENCY slots stays
+    polite; cache hits skip both. Parsing and cache file I/O run on parse_pool so
+    they don't stall other downloads.
+    """
+    external_id = listing_meta["external_id"]
+    loop = asyncio.get_running_loop()
+    content = await loop.run_in_executor(parse_pool, read_cached_html, external_id)
+    if content is None:
+        async with sem:
+            await asyncio.sleep(uniform(MIN_SLEEP, MAX_SLEEP))
+            resp = await fetch_async(http, listing_meta["url"])
+        if resp is None or not is_listing_page(resp):
+            return None
+        content = resp.content
+        await loop.run_in_executor(parse_pool, write_cached_html, external_id, content)
+    return await loop.run_in_executor(
+        parse_pool,
+        build_scraped_listing,
+        listing_meta,
+        content,
+        source,
+        listing_type,
+    )
+
+def persist_listings(
+    scraped: list[ScrapedListing],
+    source: str = "mubawab",
+    listing_type: str = "rent",
+) -> int:
+    """
+    Write a batch of scraped listings, keeping the per-listing order of the
+    old one-at-a-time path:
+      1) one upsert for all raw_listings rows
+      2) one lookup of existing images, new images to R2 per listing, then
+         one upsert for all listing_images rows
+      3) one upsert for all normalised_listings rows
+    Returns the number of listings written.
+    """
+    if not scraped:
+        return 0
+
+    save_raw_listings([item.raw_row for item in scraped])
+
+    # One query for the existing image rows of the whole batch
+    existing_images = load_existing_images(
+        [item.external_id for item in scraped if item.image_urls]
+    )
+
+    image_rows: list[dict] = []
+    normalised_rows: list[dict] = []
+    for item in scraped:
+        main_image_path = process_listing_images(
+            item.external_id,
+            item.image_urls,
+            image_rows,
+            existing_images.get(item.external_id, {}),
+        )
+        normalised_rows.append(
+            build_normalised_payload(
+                details=item.details,
+                external_id=item.external_id,
+                source=source,
+                listing_type=listing_type,
+                main_image_path=main_image_path,
+                listing_tier=item.listing_tier,
+                is_adboost=item.is_adboost,
+            )
+        )
+
+    upsert_listing_images(image_rows)
+    upsert_normalised_listings(normalised_rows)
+    return len(scraped)
 
-def classify_listing_box(box: BeautifulSoup) -> tuple[str, bool]:
+def classify_listing_box(class_attr: str) -> tuple[str, bool]:
     """
-    Based on the class list of a listingBox, return (tier, is_adboost).
+    Based on the class attribute of a listingBox, return (tier, is_adboost).
     tier: 'super_premium', 'premium', 'standard'
     """
-    classes = box.get("class", [])
-    classes_set = {c.lower() for c in classes}
+    classes_set = {c.lower() for c in class_attr.split()}
 
     is_adboost = "adboostbox" in classes_set
 
@@ -217,6 +479,51 @@ def classify_listing_box(box: BeautifulSoup) -> tuple[str, bool]:
 
     return tier, is_adboost
 
+class _ListingCardTarget:
+    """
+    lxml parser target that records (linkref, class) for every
+    div.listingBox[linkref] start tag, without building a tree.
+    """
+
+    def __init__(self) -> None:
+        self.cards: list[tuple[str, str]] = []
+
+    def start(self, tag: str, attrib: dict) -> None:
+        if tag != "div":
+            return
+        linkref = attrib.get("linkref")
+        class_attr = attrib.get("class") or ""
+        if linkref and "listingBox" in class_attr.split():
+            self.cards.append((linkref, class_attr))
+
+    def close(self) -> None:
+        return None
+
+def iter_listing_cards(content: bytes) -> Iterator[tuple[str, str]]:
+    """
+    Stream (linkref, class) pairs for the listing cards of an index page.
+    The page is fed to the parser in INDEX_FEED_SIZE chunks, so a caller
+    that stops iterating early skips tokenising the rest of the page.
+    An empty or unparseable body yields no cards.
+    """
+    if not content:
+        return
+
+    target = _ListingCardTarget()
+    parser = etree.HTMLParser(target=target, encoding="utf-8")
+
+    for start in range(0, len(content), INDEX_FEED_SIZE):
+        parser.feed(content[start:start + INDEX_FEED_SIZE])
+        if target.cards:
+            yield from target.cards
+            target.cards.clear()
+
+    try:
+        parser.close()
+    except etree.XMLSyntaxError as exc:
+        logger.warning("Could not parse index page: %s", exc)
+    yield from target.cards
+
 def get_mubawab_external_id(url: str) -> Optional[str]:
     """
     Extracts a combined ID such as:
@@ -224,122 +531,204 @@ def get_mubawab_external_id(url: str) -> Optional[str]:
     - 'pa4634098'
     from any URL containing /a/ or /pa/ or similar.
     """
-    match = re.search(r"/(a|pa)/(\d+)", url)
+    match = _RE_EXT_ID.search(url)
     if match:
         prefix = match.group(1)
         number = match.group(2)
         return f"{prefix}{number}"
     return None
 
-def save_raw_listing(
+def dedupe_by_external_id(rows: list[dict]) -> list[dict]:
+    """
+    Keep the last row per external_id. Postgres rejects an upsert batch
+    that touches the same row twice.
+    """
+    return list({row["external_id"]: row for row in rows}.values())
+
+def compress_html(html: Union[str, bytes]) -> str:
+    """gzip + base64 a page so it can sit in payload_json as a string."""
+    if isinstance(html, str):
+        html = html.encode("utf-8")
+    packed = gzip.compress(html, compresslevel=HTML_GZIP_LEVEL)
+    return base64.b64encode(packed).decode("ascii")
+
+def decompress_html(html_gz_b64: str) -> str:
+    """
+    Inverse of compress_html. Pages are stored as the bytes the site sent,
+    so stray invalid UTF-8 is replaced rather than raised on.
+    """
+    return gzip.decompress(base64.b64decode(html_gz_b64)).decode("utf-8", "replace")
+
+def build_raw_listing_row(
     source: str,
     external_id: str,
     link: str,
-    response_text: str,
+    response_text: Union[str, bytes],
     image_urls: list[str],
     *,
     listing_tier: str,
     is_adboost: bool,
     details: PropertyDetails,
-) -> None:
+    listing_type: str = "rent",
+) -> dict:
     """
-    Inserts or upserts the raw listing into the raw_listings table.
+    Build the raw_listings row for a listing.
 
     IMPORTANT: agent_url lives here (in payload_json), not in normalised_listings.
+    The page is stored gzipped as html_gz_b64; rows written before that
+    carry plain "html" instead, so readers must accept either.
+    listing_type is recorded so the repair scripts can rebuild normalised
+    rows with it; rows written before it was stored are all rent.
     """
     payload = {
         "url": link,
-        "html": response_text,
+        "html_gz_b64": compress_html(response_text),
         "image_urls": image_urls,
-        "scraped_at_client": datetime.now(timezone.utc).isoformat(),
         "listing_tier": listing_tier,
         "is_adboost": is_adboost,
+        "listing_type": listing_type,
         "agent_type": details.agent_type,
         "agent_name": details.agent_name,
         "agent_url": details.agent_url,
     }
 
-    try:
-        supabase.table("raw_listings").upsert(
-            {
-                "external_id": external_id,
-                "source": source,
-                "payload_json": payload,
-            },
-            on_conflict="external_id",
-        ).execute()
-    except Exception as e:
-        logging.error("Error saving raw listing to Supabase for %s: %s", link, e)
+    return {
+        "external_id": external_id,
+        "source": source,
+        "payload_json": payload,
+    }
 
+def save_raw_listings(rows: list[dict]) -> None:
+    """
+    Upsert a batch of raw_listings rows, UPSERT_BATCH_SIZE rows per
+    request. Every row in the batch gets the same
+    payload_json.scraped_at_client timestamp.
+    """
+    if not rows:
+        return
+    scraped_at = datetime.now(timezone.utc).isoformat()
+    for row in rows:
+        row["payload_json"]["scraped_at_client"] = scraped_at
+    unique = dedupe_by_external_id(rows)
+    for start in range(0, len(unique), UPSERT_BATCH_SIZE):
+        chunk = unique[start:start + UPSERT_BATCH_SIZE]
+        try:
+            supabase.table("raw_listings").upsert(
+                chunk,
+                on_conflict="external_id",
+            ).execute()
+        except Exception as e:
+            logger.error("Error saving %d raw listings to Supabase: %s", len(chunk), e)
 
-def upsert_normalised_listing(
+def build_normalised_payload(
     details: PropertyDetails,
     external_id: str,
     *,
     source: str = "mubawab",
     listing_type: str = "rent",
-    listing_tier: str,
-    is_adboost: bool,
+    listing_tier: Optional[str],
+    is_adboost: Optional[bool],
     main_image_path: str | None = None,
-) -> None:
+) -> dict:
     """
-    Write a clean, ML-ready row to normalised_listings.
+    Build a clean, ML-ready row for normalised_listings.
 
     NOTE: agent_url is NOT stored here.
     """
-    payload = {
-        "external_id": external_id,
-        "source": source,
-        "listing_type": listing_type,
-        "title": details.title,
-        "description": details.description,
-        "property_type": details.property_type,
-        "city": details.city,
-        "area": details.area,
-        "size": details.size,
-        "rooms": details.rooms,
-        "bedrooms": details.bedrooms,
-        "bathrooms": details.bathrooms,
-        "price": details.price,
-        "features": details.features,
-        "condition": details.condition,
-        "age": details.age,
-        "orientation": details.orientation,
-        "flooring": details.flooring,
-        "floor_number": details.floor_number,
-        "number_of_floors": details.number_of_floors,
-        "lat": details.lat,
-        "lon": details.lon,
-        "url": details.url,
-        "main_image_path": main_image_path,
-        
-        "agent_type": details.agent_type,
-        "agent_name": details.agent_name,
-        "listing_tier": listing_tier,
-        "is_adboost": is_adboost,
-    }
+    payload = dict(zip(_NORMALISED_FIELDS, _NORMALISED_GET(details)))
+    payload.update(
+        {
+            "external_id": external_id,
+            "source": source,
+            "listing_type": listing_type,
+            "main_image_path": main_image_path,
+            "listing_tier": listing_tier,
+            "is_adboost": is_adboost,
+        }
+    )
+    return payload
 
-    supabase.table("normalised_listings").upsert(
-        payload,
-        on_conflict="external_id",
-    ).execute()
+def upsert_normalised_listings(payloads: list[dict]) -> None:
+    """Upsert a batch of normalised_listings rows, UPSERT_BATCH_SIZE rows per request."""
+    if not payloads:
+        return
+    unique = dedupe_by_external_id(payloads)
+    for start in range(0, len(unique), UPSERT_BATCH_SIZE):
+        supabase.table("normalised_listings").upsert(
+            unique[start:start + UPSERT_BATCH_SIZE],
+            on_conflict="external_id",
+        ).execute()
+
+def upsert_listing_images(rows: list[dict]) -> None:
+    """
+    Upsert a batch of listing_images rows, UPSERT_BATCH_SIZE rows per
+    request (a write batch of listings carries many images each).
+    """
+    if not rows:
+        return
+    # Same rule as dedupe_by_external_id, keyed on the table's conflict target
+    unique = list({(row["external_id"], row["image_index"]): row for row in rows}.values())
+    for start in range(0, len(unique), UPSERT_BATCH_SIZE):
+        supabase.table("listing_images").upsert(
+            unique[start:start + UPSERT_BATCH_SIZE],
+            on_conflict="external_id,image_index",
+        ).execute()
         
 #--------------Scraper Functions--------------#
 
-def fetch(url: str) -> Optional[requests.Response]:
-    """HTTP GET request with logging, timeout, and error handling."""
-    try:
-        resp = session.get(url, timeout=REQUEST_TIMEOUT)
-        resp.raise_for_status()
-        return resp
-    except requests.RequestException as exc:
-        logging.error("Request failed for %s: %s", url, exc)
-        return None
+def retry_delay(resp: httpx.Response, attempt: int) -> float:
+    """
+    Seconds to wait before retrying resp. Honours a numeric Retry-After
+    (sent with 429/503, capped at MAX_RETRY_AFTER), otherwise exponential
+    backoff with up to BACKOFF_FACTOR of jitter, so concurrent requests
+    that failed together don't all retry at the same instant.
+    """
+    retry_after = resp.headers.get("Retry-After", "")
+    if retry_after.isdigit():
+        return min(float(retry_after), MAX_RETRY_AFTER)
+    return min(BACKOFF_FACTOR * 2 ** attempt, MAX_RETRY_AFTER) + uniform(0, BACKOFF_FACTOR)
+
+def fetch(url: str) -> Optional[httpx.Response]:
+    """HTTP GET request with logging, timeout, retries, and error handling."""
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            resp = session.get(url)
+            if resp.status_code in RETRY_STATUSES and attempt < MAX_RETRIES:
+                sleep(retry_delay(resp, attempt))
+                continue
+            resp.raise_for_status()
+            return resp
+        except (httpx.HTTPError, httpx.InvalidURL) as exc:
+            logger.error("Request failed for %s: %s", url, exc)
+            return None
+    return None
+
+async def fetch_async(http: httpx.AsyncClient, url: str) -> Optional[httpx.Response]:
+    """
+    Async HTTP GET with the same retry policy as fetch()
+    (RETRY_STATUSES, Retry-After or exponential backoff).
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            resp = await http.get(url)
+            if resp.status_code in RETRY_STATUSES and attempt < MAX_RETRIES:
+                await asyncio.sleep(retry_delay(resp, attempt))
+                continue
+            resp.raise_for_status()
+            return resp
+        except (httpx.HTTPError, httpx.InvalidURL) as exc:
+            logger.error("Request failed for %s: %s", url, exc)
+            return None
+    return None
 
 def get_links(
     base_url: str,
     max_pages: int,
-    existing_ids: set[str],
+    existing_ids: Optional[set[str]] = None,
+    stop_external_id: Optional[str] = None,
+    known_streak_limit: Optional[int] = None,
+    source: str = "mubawab",
+    listing_type: Optional[str] = "rent",
 ) -> list[dict]:
     """
     Scrape ALL listing cards from Mubawab (up to max_pages) and return
@@ -354,34 +743,39 @@ def get_links(
 
     We skip:
       - already-scraped external_ids,
+      - cards already collected this run (listings shift pages while we paginate),
       - adBoostBox cards (sale ads in rent pages).
+
+    If existing_ids is None, each page's ids are checked against the
+    source/listing_type rows of normalised_listings with one query
+    (find_known_external_ids).
+
+    If stop_external_id is given (e.g. the newest id of the previous run),
+    pagination stops as soon as that card is reached, and the rest of that
+    page is not parsed. If known_streak_limit is given (around 20 suits
+    incremental runs), pagination stops after that many already-known
+    cards in a row.
     """
-    from bs4 import BeautifulSoup
     new_listings: list[dict] = []
+    seen_ids: set[str] = set()
+    stopped = False
+    consecutive_known = 0
 
     for page in range(1, max_pages + 1):
         page_url = f"{base_url}:p:{page}"
-        logging.info("Processing page %s", page_url)
+        logger.info("Processing page %s", page_url)
 
         resp = fetch(page_url)
         if resp is None:
-            logging.warning("Failed to fetch page %s, stopping pagination.", page_url)
-            break
-
-        soup = BeautifulSoup(resp.text, "html.parser")
-
-        # div.listingBox[linkref] was your working selector
-        boxes = soup.select("div.listingBox[linkref]")
-        if not boxes:
-            logging.info("No listings found on page %s, stopping.", page)
+            logger.warning("Failed to fetch page %s, stopping pagination.", page_url)
             break
 
-        logging.info("Found %d listing elements on page %d", len(boxes), page)
-
-        for box in boxes:
-            url = box.get("linkref")
-            if not url:
-                continue
+        # Index pages only need two attributes per card, so stream them out
+        # of lxml's parser instead of building a tree for the whole page
+        card_count = 0
+        cards: list[tuple[str, str, str]] = []
+        for url, class_attr in iter_listing_cards(resp.content):
+            card_count += 1
 
             if url.startswith("/"):
                 url = "https://www.mubawab.ma" + url
@@ -390,16 +784,46 @@ def get_links(
             if not external_id:
                 continue
 
+            if external_id == stop_external_id:
+                logger.info("Reached last seen listing %s on page %d, stopping.", external_id, page)
+                stopped = True
+                break
+
+            if external_id in seen_ids:
+                continue
+            seen_ids.add(external_id)
+
+            cards.append((url, external_id, class_attr))
+
+        if existing_ids is not None:
+            known_ids = existing_ids
+        else:
+            known_ids = find_known_external_ids(
+                [card[1] for card in cards], source, listing_type
+            )
+
+        for url, external_id, class_attr in cards:
             # skip if already normalised
-            if external_id in existing_ids:
+            if external_id in known_ids:
+                consecutive_known += 1
+                if known_streak_limit is not None and consecutive_known >= known_streak_limit:
+                    logger.info(
+                        "%d known listings in a row on page %d, stopping.",
+                        consecutive_known,
+                        page,
+                    )
+                    stopped = True
+                    break
                 continue
 
-            listing_tier, is_adboost = classify_listing_box(box)
+            listing_tier, is_adboost = classify_listing_box(class_attr)
 
-            # drop adBoostBox from the rental dataset
+            # drop adBoostBox from the rental dataset; these are never stored,
+            # so they must not break a run of known listings either
             if is_adboost:
                 continue
 
+            consecutive_known = 0
             new_listings.append(
                 {
                     "url": url,
@@ -409,34 +833,26 @@ def get_links(
                 }
             )
 
+        if stopped:
+            break
+
+        if not card_count:
+            logger.info("No listings found on page %s, stopping.", page)
+            break
+
+        logger.info("Found %d listing elements on page %d", card_count, page)
+
         sleep(uniform(MIN_SLEEP, MAX_SLEEP))
 
-    logging.info("Total NEW links collected this run: %d", len(new_listings))
+    logger.info("Total NEW links collected this run: %d", len(new_listings))
     return new_listings
 
-def get_image_links(soup: BeautifulSoup) -> list[str]:
+def extract_image_urls_from_tree(tree: etree._Element) -> list[str]:
     """
-    Extracts all image URLs from the masonryPhoto container.
+    Extracts all image URLs from the masonryPhoto container of a parsed
+    listing page, deduplicated in page order.
     """
-    urls: list[str] = []
-    container = soup.find("div", id="masonryPhoto")
-    if not container:
-        return urls
-
-    for img in container.find_all("img"):
-        src = img.get("src")
-        if src:
-            urls.append(src)
-
-    # Deduplicate while preserving order
-    seen = set()
-    unique_urls = []
-    for u in urls:
-        if u not in seen:
-            unique_urls.append(u)
-            seen.add(u)
-
-    return unique_urls
+    return list(dict.fromkeys(src for src in _XP_IMAGE_SRCS(tree) if src))
     
 #--------------Data Cleaning Functions--------------#
 
@@ -456,7 +872,7 @@ def clean_integer(number_str: Optional[str]) -> Optional[int]:
         return None
     try:
         # Remove all non-digit characters
-        cleaned = re.sub(r'[^\d]', '', number_str)
+        cleaned = _RE_NON_DIGIT.sub('', number_str)
         return int(cleaned) if cleaned else None
     except (ValueError, TypeError):
         return None
@@ -464,8 +880,11 @@ def clean_integer(number_str: Optional[str]) -> Optional[int]:
 def clean_text(text: Optional[str]) -> Optional[str]:
     return text.strip() if text else None
 
+# Feature labels and most values repeat verbatim across listings, so cache
+# them. split/join is kept over a \s+ regex, which is ~4x slower here.
+@lru_cache(maxsize=4096)
 def clean_att(s: str) -> str:
-    return " ".join(s.split()).strip()
+    return " ".join(s.split())
 
 def clean_age(age_str):
     """
@@ -478,7 +897,7 @@ def clean_age(age_str):
     if 'years' not in age_str_lower:
         return None
 
-    numbers = re.findall(r'\d+', age_str)
+    numbers = _RE_DIGITS.findall(age_str)
     if len(numbers) == 2:
         return f"{int(numbers[0])}-{int(numbers[1])}"
     return None
@@ -486,43 +905,34 @@ def clean_age(age_str):
 def clean_rooms(description: Optional[str]) -> Optional[int]:
     if not description:
         return None
-    pattern = r'(\d+)\s*(?:\w+\s)?rooms?\b'
-    match = re.search(pattern, description, re.IGNORECASE)
+    match = _RE_ROOMS.search(description)
     if match:
         return int(match.group(1))
     return None
 
-def clean_condition(cond_str):
-    try:
-        if not cond_str:
-            return None
-        
-        if cond_str == 'Good condition':
-            cond_str = 'Good'
-            return cond_str
-        elif cond_str == 'Due for reform':
-            cond_str == 'Old'
-            return cond_str
-        elif cond_str == 'New':
-            return cond_str
-        else:
-            return None
-    except ValueError:
-        return None
+# Site condition label -> stored value; anything else is stored as None
+_COND_MAP = {
+    "Good condition": "Good",
+    "Due for reform": "Old",
+    "New": "New",
+}
+
+
+def clean_condition(cond_str: Optional[str]) -> Optional[str]:
+    return _COND_MAP.get(cond_str) if cond_str else None
     
 def parse_area_and_city(raw_area_text: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
     if not raw_area_text:
-        logging.warning("raw_area_text is None or empty.")
+        logger.warning("raw_area_text is None or empty.")
         return None, None
     
     raw_area_text = raw_area_text.strip()
-    pattern = r'^(.*)\s+in\s+(.*)$'
-    match = re.search(pattern, raw_area_text, re.IGNORECASE)
+    match = _RE_AREA_IN.search(raw_area_text)
     
     if match:
         area = match.group(1).strip()
         city = match.group(2).strip()
-        logging.debug(
+        logger.debug(
             "Parsed area: '%s', city: '%s' from raw_area_text: '%s'",
             area,
             city,
@@ -531,102 +941,224 @@ def parse_area_and_city(raw_area_text: Optional[str]) -> Tuple[Optional[str], Op
     else:
         area = None
         city = raw_area_text.strip()
-        logging.debug(
+        logger.debug(
             "No 'in' found. Set area to None and city to '%s' from raw_area_text: '%s'",
             city,
             raw_area_text,
         )
     return area, city
 
-def extract_coordinates(soup: BeautifulSoup) -> Tuple[Optional[float], Optional[float]]:
+def extract_coordinates(tree: etree._Element) -> Tuple[Optional[float], Optional[float]]:
     lat: Optional[float] = None
     lon: Optional[float] = None
     
-    scripts = soup.find_all("script")
-    for s in scripts:
-        if s.string and "waze.com/ul" in s.string:
-            match = re.search(r"waze\.com/ul\?ll=([^&]+)", s.string)
-            if match:
-                ll = unquote(match.group(1))
-                try:
-                    lat_str, lon_str = ll.split(",")                    
-                    lat = float(lat_str)
-                    lon = float(lon_str)
-                    break
-                except ValueError:
-                    logging.error(f"Error parsing lat/long from: {ll}")
+    for text in _XP_WAZE_TEXTS(tree):
+        match = _RE_WAZE.search(text)
+        if match:
+            ll = unquote(match.group(1))
+            try:
+                lat_str, lon_str = ll.split(",")                    
+                lat = float(lat_str)
+                lon = float(lon_str)
+                break
+            except ValueError:
+                logger.error("Error parsing lat/long from: %s", ll)
     
     return lat, lon
 
-def process_listing_images(external_id: str, image_urls: list[str]) -> str | None:
+def upload_avif_to_r2(external_id: str, idx: int, url: str) -> Optional[str]:
+    """
+    Download one listing image and store it in R2 as
+    mubawab/<external_id>/<idx>.avif.
+    Returns the object key (used as storage_path), or None on failure.
+    """
+    resp = fetch(url)
+    if resp is None:
+        return None
+
+    key = f"mubawab/{external_id}/{idx}.avif"
+    try:
+        r2_client.put_object(
+            Bucket=CF_BUCKET,
+            Key=key,
+            Body=resp.content,
+            ContentType=resp.headers.get("Content-Type", "image/avif"),
+        )
+    except Exception as e:
+        logger.error("Failed to upload %s to R2: %s", key, e)
+        return None
+    return key
+
+def load_existing_images(external_ids: list[str]) -> dict[str, dict[int, str]]:
+    """
+    Fetch the listing_images rows of many listings, IN_QUERY_CHUNK_SIZE
+    ids per query. Returns {external_id: {image_index: storage_path}};
+    listings without rows are absent.
+    """
+    existing: dict[str, dict[int, str]] = {}
+
+    for start in range(0, len(external_ids), IN_QUERY_CHUNK_SIZE):
+        chunk = external_ids[start:start + IN_QUERY_CHUNK_SIZE]
+
+        # A chunk can hold more image rows than PostgREST returns per
+        # response, so page through them in a stable order
+        offset = 0
+        while True:
+            rows = (
+                supabase.table("listing_images")
+                .select("external_id,image_index,storage_path")
+                .in_("external_id", chunk)
+                .order("external_id")
+                .order("image_index")
+                .range(offset, offset + SELECT_PAGE_SIZE - 1)
+                .execute()
+                .data
+            ) or []
+            for row in rows:
+                existing.setdefault(row["external_id"], {})[row["image_index"]] = row["storage_path"]
+            if len(rows) < SELECT_PAGE_SIZE:
+                break
+            offset += SELECT_PAGE_SIZE
+
+    return existing
+
+# (external_id, image_index) -> storage_path for every image this process
+# has uploaded, so a listing seen twice in one run is not uploaded twice
+_uploaded_images: dict[tuple[str, int], str] = {}
+
+
+def process_listing_images(
+    external_id: str,
+    image_urls: list[str],
+    pending_rows: Optional[list[dict]] = None,
+    existing: Optional[dict[int, str]] = None,
+) -> str | None:
     """
     For a given listing:
       - uploads each image to Storage
       - inserts/updates listing_images rows
+    Pass pending_rows to collect the new listing_images rows there instead,
+    so the caller can write several listings' images in one request.
+    Pass existing ({image_index: storage_path}, see load_existing_images)
+    when the caller already knows the listing's rows.
     Returns the storage_path of the first image (for main_image_path),
     or None if no images processed.
     """
     main_image_path: str | None = None
-
+    new_rows: list[dict] = [] if pending_rows is None else pending_rows
+    if not image_urls:
+        return main_image_path
+
+    if existing is None:
+        # One query for every image row this listing already has
+        existing = load_existing_images([external_id]).get(external_id, {})
+
+    # If we already have a row for image 0, reuse its storage_path
+    main_image_path = existing.get(0)
+
+    # Skip image indexes that already have a row. Indexes uploaded earlier
+    # in this run still get their row (that write may not have landed), but
+    # reuse the stored object; download + upload the rest in parallel, since
+    # each one is two network round-trips
+    uploaded: list[tuple[int, str, str]] = []
+    todo: list[tuple[int, str]] = []
     for idx, url in enumerate(image_urls):
-        # Skip if this image_index already exists
-        existing = (
-            supabase.table("listing_images")
-            .select("external_id")
-            .eq("external_id", external_id)
-            .eq("image_index", idx)
-            .execute()
-        )
-        if existing.data:
-            # If we already have a row, use its storage_path for main_image_path if needed
-            if main_image_path is None and idx == 0:
-                main_image_path = (
-                    supabase.table("listing_images")
-                    .select("storage_path")
-                    .eq("external_id", external_id)
-                    .eq("image_index", idx)
-                    .limit(1)
-                    .execute()
-                    .data[0]["storage_path"]
-                )
+        if idx in existing:
             continue
+        storage_path = _uploaded_images.get((external_id, idx))
+        if storage_path:
+            uploaded.append((idx, url, storage_path))
+        else:
+            todo.append((idx, url))
 
-        storage_path = upload_avif_to_r2(external_id, idx, url)
-        if not storage_path:
-            continue
+    if todo:
+        with ThreadPoolExecutor(max_workers=min(IMAGE_WORKERS, len(todo))) as pool:
+            storage_paths = list(
+                pool.map(lambda job: upload_avif_to_r2(external_id, *job), todo)
+            )
 
-        supabase.table("listing_images").upsert(
+        for (idx, url), storage_path in zip(todo, storage_paths):
+            if storage_path:
+                _uploaded_images[(external_id, idx)] = storage_path
+                uploaded.append((idx, url, storage_path))
+
+    for idx, url, storage_path in uploaded:
+        new_rows.append(
             {
                 "external_id": external_id,
                 "image_index": idx,
                 "original_url": url,
                 "storage_path": storage_path,
-            },
-            on_conflict="external_id,image_index",
-        ).execute()
+            }
+        )
 
         if main_image_path is None and idx == 0:
             main_image_path = storage_path
 
+    if pending_rows is None:
+        upsert_listing_images(new_rows)
+
     return main_image_path
     
 #--------------Main Scraper Logic--------------#
 
+def _features_dict(tree: etree._Element) -> dict[str, str]:
+    """Collect the label -> value pairs from the adFeatures block."""
+    label_value: dict[str, str] = {}
+    for content in _XP_MAIN_FEATURES(tree):
+        # One walk over the row's <p> tags finds the first label and the
+        # first value, instead of an XPath evaluation for each
+        label_tag = value_tag = None
+        for p in content.iter("p"):
+            classes = (p.get("class") or "").split()
+            if label_tag is None and "adMainFeatureContentLabel" in classes:
+                label_tag = p
+            if value_tag is None and "adMainFeatureContentValue" in classes:
+                value_tag = p
+        if label_tag is None or value_tag is None:
+            continue
+        label = clean_att(node_text(label_tag))
+        value = clean_att(node_text(value_tag))
+        label_value[label] = value
+    return label_value
+
+def parse_tree(html: Union[str, bytes]) -> etree._Element:
+    """
+    Parse a property detail page (text or raw UTF-8 bytes) into an lxml tree.
+    Raises etree.ParserError if the document is empty or unparseable.
+    """
+    if isinstance(html, str):
+        html = html.encode("utf-8")
+    tree = etree.fromstring(html, parser=_detail_parser())
+    if tree is None:
+        raise etree.ParserError("Document is empty")
+    return tree
+
 def parse_property_page(link: str, html: str) -> Optional[PropertyDetails]:
     """Parse a single property detail HTML into a PropertyDetails object."""
-    soup = BeautifulSoup(html, 'html.parser')
-    
-    price_tag = soup.find('h3', class_='orangeTit')
-    area_tag = soup.find('h3', class_='greyTit')
-    title_tag = soup.find('h1', class_='searchTitle')
+    try:
+        tree = parse_tree(html)
+    except etree.ParserError as exc:
+        logger.warning("Could not parse HTML for %s: %s", link, exc)
+        return None
+    return parse_property_page_from_tree(link, tree)
+
+def parse_property_page_from_tree(
+    link: str,
+    tree: etree._Element,
+) -> Optional[PropertyDetails]:
+    """Build a PropertyDetails object from an already-parsed detail page."""
+    price_tags = _XP_PRICE(tree)
+    area_tags = _XP_AREA(tree)
+    title_tags = _XP_TITLE(tree)
     
-    if not (price_tag and area_tag and title_tag):
-        logging.warning(f"Missing critical tags on page {link}, skipping.")
+    if not (price_tags and area_tags and title_tags):
+        logger.warning("Missing critical tags on page %s, skipping.", link)
         return None
     
-    raw_price = price_tag.get_text(strip=True)
-    raw_area_text = area_tag.get_text(strip=True)
-    raw_title = title_tag.get_text(strip=True)
+    raw_price = node_text(price_tags[0], strip=True)
+    raw_area_text = node_text(area_tags[0], strip=True)
+    raw_title = node_text(title_tags[0], strip=True)
     
     price = clean_integer(raw_price)
     title = clean_text(raw_title)
@@ -634,27 +1166,17 @@ def parse_property_page(link: str, html: str) -> Optional[PropertyDetails]:
     
     #-- Description --#
     text_content: Optional[str] = None
-    description_div = soup.find('div', class_='wordBreak')
-    if description_div:
-        text_content = description_div.get_text(separator=" ").strip()
+    description_divs = _XP_DESCRIPTION(tree)
+    if description_divs:
+        text_content = node_text(description_divs[0], separator=" ").strip()
     else:
-        for p in soup.find_all('p'):
-            if len(p.text.strip()) > 50:
-                text_content = p.get_text(separator=" ").strip()
+        for p in _XP_LONG_PARAGRAPHS(tree):
+            if len(node_text(p).strip()) > 50:
+                text_content = node_text(p, separator=" ").strip()
                 break
             
     #-- Main features --#
-    features_block = soup.find("div", class_="adFeatures")
-    label_value: dict[str, str] = {}
-    if features_block:
-        for content in features_block.select("div.adMainFeatureContent"):
-            label_tag = content.find("p", class_="adMainFeatureContentLabel")
-            value_tag = content.find("p", class_="adMainFeatureContentValue")
-            if not label_tag or not value_tag:
-                continue
-            label = clean_att(label_tag.get_text())
-            value = clean_att(value_tag.get_text())
-            label_value[label] = value
+    label_value = _features_dict(tree)
             
     prop_type = label_value.get("Type of property")
     condition = clean_condition(label_value.get("Condition"))
@@ -665,40 +1187,34 @@ def parse_property_page(link: str, html: str) -> Optional[PropertyDetails]:
     number_of_floors = clean_integer(label_value.get("Number of floors"))
     
     #-- Additional details --#
-    size: Optional[int] = None
-    rooms: Optional[int] = None
-    bedrooms: Optional[int] = None
-    bathrooms: Optional[int] = None
-    
-    details_block = soup.find_all('div', class_='adDetailFeature')
-    for detail in details_block:
-        text = detail.get_text(strip=True)
-        span = detail.find('span')
-        if not span:
-            continue
-        value = span.get_text(strip=True)
-        
-        if 'm²' in text:
-            size = clean_integer(value)
-        if 'Pieces' in text or 'Piece' in text:
-            rooms = clean_integer(value)
-        if 'Rooms' in text or 'Room' in text:
-            bedrooms = clean_integer(value)
-        if 'Bathrooms' in text or 'Bathroom' in text:
-            bathrooms = clean_integer(value)
+    # Each adDetailFeature holds one figure; the first matching token wins.
+    detail_values: dict[str, Optional[int]] = {}
+    for detail in _XP_DETAIL_FEATURES(tree):
+        text = node_text(detail, strip=True).lower()
+        for token, key in DETAIL_CATEGORIES:
+            if token in text:
+                span = next(detail.iter("span"), None)
+                if span is not None:
+                    detail_values[key] = clean_integer(node_text(span, strip=True))
+                break
+
+    size = detail_values.get("size")
+    rooms = detail_values.get("rooms")
+    bedrooms = detail_values.get("bedrooms")
+    bathrooms = detail_values.get("bathrooms")
             
     if rooms is None and text_content:
         rooms = clean_rooms(text_content)
         
     #-- Feature List --#
-    features_tags = soup.find_all('p', class_='fSize11 centered')
-    features_list = [clean_text(tag.get_text()) for tag in features_tags]
-    feature_str = ', '.join(filter(None, features_list)) if features_list else None
+    feature_str = ', '.join(
+        text for text in (node_text(tag).strip() for tag in _XP_FEATURE_PILLS(tree)) if text
+    ) or None
     
-    lat, lon = extract_coordinates(soup)
+    lat, lon = extract_coordinates(tree)
 
     # 👇 NEW: agent metadata
-    agent_type, agent_name, agent_url = extract_agent_info(soup)
+    agent_type, agent_name, agent_url = extract_agent_info(tree)
     
     return PropertyDetails(
         title=title,
@@ -726,22 +1242,113 @@ def parse_property_page(link: str, html: str) -> Optional[PropertyDetails]:
         agent_url=agent_url,
     )
 
+def _persist_batch(
+    batch: list[ScrapedListing],
+    source: str,
+    listing_type: str,
+) -> int:
+    try:
+        return persist_listings(batch, source, listing_type)
+    except Exception as e:
+        logger.error("Failed to write batch of %d listings: %s", len(batch), e)
+        return 0
+
+async def _write_batches(
+    queue: asyncio.Queue,
+    source: str,
+    listing_type: str,
+    batch_size: int,
+) -> int:
+    """
+    Drain scraped listings from the queue and write them batch_size at a
+    time. The Supabase/R2 clients are blocking, so writes run in a thread.
+    Returns the number of listings written.
+    """
+    written = 0
+    pending: list[ScrapedListing] = []
+    while True:
+        item = await queue.get()
+        if item is not None:
+            pending.append(item)
+        if pending and (item is None or len(pending) >= batch_size):
+            batch, pending = pending, []
+            written += await asyncio.to_thread(_persist_batch, batch, source, listing_type)
+        if item is None:
+            return written
+
+async def get_details_async(
+    listings_meta: list[dict],
+    source: str = "mubawab",
+    listing_type: str = "rent",
+    batch_size: int = UPSERT_BATCH_SIZE,
+    concurrency: int = CONCURRENCY,
+) -> int:
+    """
+    Fetch up to `concurrency` listing pages at a time, parse them on
+    PARSE_WORKERS threads and write the results in batches of batch_size.
+    The connection pool is capped at `concurrency` too, so the semaphore
+    is the only thing deciding how hard mubawab.ma gets hit.
+    Returns the number of listings written.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    sem = asyncio.Semaphore(concurrency)
+
+    with ThreadPoolExecutor(max_workers=PARSE_WORKERS) as parse_pool:
+        async with httpx.AsyncClient(
+            http2=True,
+            headers={"User-Agent": USER_AGENT},
+            timeout=REQUEST_TIMEOUT,
+            follow_redirects=True,
+            transport=httpx.AsyncHTTPTransport(
+                http2=True,
+                retries=MAX_RETRIES,
+                limits=httpx.Limits(
+                    max_connections=concurrency,
+                    max_keepalive_connections=concurrency,
+                ),
+            ),
+        ) as http:
+            writer = asyncio.create_task(
+                _write_batches(queue, source, listing_type, batch_size)
+            )
+
+            async def scrape(listing_meta: dict) -> None:
+                try:
+                    result = await process_single_listing_async(
+                        http, sem, parse_pool, listing_meta, source, listing_type
+                    )
+                except Exception as e:
+                    logger.error("Unhandled exception processing %s: %s", listing_meta["url"], e)
+                    return
+                if result is not None:
+                    await queue.put(result)
+
+            tasks = [scrape(listing_meta) for listing_meta in listings_meta]
+            for task in tqdm.tqdm(
+                asyncio.as_completed(tasks),
+                total=len(tasks),
+                desc="Scraping property details",
+            ):
+                await task
+
+            await queue.put(None)
+            written = await writer
+
+    return written
+
 def get_details(
     listings_meta: list[dict],
     source: str = "mubawab",
     listing_type: str = "rent",
-) -> pd.DataFrame:
-    rows: list[dict] = []
-    for listing_meta in tqdm.tqdm(listings_meta, desc="Scraping property details"):
-        try:
-            result = process_single_listing(listing_meta, source, listing_type)
-            if result is not None:
-                rows.append(result)
-        except Exception as e:
-            logging.error("Unhandled exception processing %s: %s", listing_meta["url"], e)
-    return pd.DataFrame(rows)
+    batch_size: int = UPSERT_BATCH_SIZE,
+    concurrency: int = CONCURRENCY,
+) -> int:
+    """Sync entry point: scrape listings concurrently, write in batches."""
+    return asyncio.run(
+        get_details_async(listings_meta, source, listing_type, batch_size, concurrency)
+    )
 
-def extract_agent_info(soup: BeautifulSoup) -> tuple[Optional[str], Optional[str], Optional[str]]:
+def extract_agent_info(tree: etree._Element) -> tuple[Optional[str], Optional[str], Optional[str]]:
     """
     Extract agent_type, agent_name, agent_url from the property page.
 
@@ -754,22 +1361,20 @@ def extract_agent_info(soup: BeautifulSoup) -> tuple[Optional[str], Optional[str
     agent_name = None
     agent_url = None
 
-    info = soup.find("div", class_="businessInfo")
-    if not info:
-        return agent_type, agent_name, agent_url
-
-    # The agency / individual name is in span.link.businessName
-    span = info.select_one("span.link.businessName")
-    if not span:
+    # The agency / individual name is in div.businessInfo span.link.businessName
+    spans = _XP_BUSINESS_NAME(tree)
+    if not spans:
         return agent_type, agent_name, agent_url
+    span = spans[0]
 
     # If there's an <a>, it's an agency with its own page
-    a_tag = span.find("a", href=True)
-    if a_tag:
-        agent_name = a_tag.get_text(strip=True)
-        agent_url = a_tag["href"]
+    links = _XP_LINK(span)
+    if links:
+        a_tag = links[0]
+        agent_name = node_text(a_tag, strip=True)
+        agent_url = a_tag.get("href")
         # look for "Agency" / "Particular" text nearby
-        type_text = span.get_text(" ", strip=True).lower()
+        type_text = node_text(span, separator=" ", strip=True).lower()
         if "agency" in type_text:
             agent_type = "agency"
         elif "particular" in type_text:
@@ -778,7 +1383,7 @@ def extract_agent_info(soup: BeautifulSoup) -> tuple[Optional[str], Optional[str
             agent_type = "agency"  # sensible default
     else:
         # No link → usually a private individual
-        agent_name = span.get_text(strip=True)
+        agent_name = node_text(span, strip=True)
         agent_type = "individual"
 
     return agent_type, agent_name, agent_url
@@ -792,33 +1397,30 @@ def main() -> None:
     # Full catalog: you said ~535 pages for rent
     max_pages = 536
 
-    logging.info("Loading existing external_ids cache from normalised_listings...")
-    existing_ids = load_existing_external_ids(source="mubawab", listing_type="rent")
-    logging.info("Loaded %d existing external_ids into cache.", len(existing_ids))
-
-    logging.info("Starting full scan link scraping (skipping already-scraped IDs)...")
+    logger.info("Starting full scan link scraping (skipping already-scraped IDs)...")
     listings = get_links(
         base_url=base_url,
         max_pages=max_pages,
-        existing_ids=existing_ids,
+        source="mubawab",
+        listing_type="rent",
     )
-    logging.info("Collected %d NEW listings to scrape.", len(listings))
+    logger.info("Collected %d NEW listings to scrape.", len(listings))
 
     if not listings:
-        logging.info("No new listings found. Exiting.")
+        logger.info("No new listings found. Exiting.")
         return
 
-    logging.info(
+    logger.info(
         "Scraping property details and writing to Supabase + R2 for %d listings...",
         len(listings),
     )
-    df = get_details(
+    count = get_details(
         listings,
         source="mubawab",
         listing_type="rent",
     )
-    logging.info("Scraped %d NEW properties this run.", len(df))
-    logging.info("Done.")
+    logger.info("Scraped %d NEW properties this run.", count)
+    logger.info("Done.")
 
 
 if __name__ == "__main__":